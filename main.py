@@ -1,13 +1,16 @@
 import os
+import signal
+import threading
 import time
-import json
 import logging
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-from decimal import Decimal
+import logging.handlers
+import math
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from statsmodels.tsa.stattools import coint
 from coinbase_agentkit import (
     AgentKit,
     AgentKitConfig,
@@ -29,33 +32,117 @@ WINDOW_SIZE_HOURS = int(os.getenv("WINDOW_SIZE_HOURS", 24))
 TRADE_SIZE_PCT = float(os.getenv("TRADE_SIZE_PCT", 0.02))
 DAILY_STOP_LOSS_PCT = float(os.getenv("DAILY_STOP_LOSS_PCT", 0.05))
 NETWORK_ID = os.getenv("NETWORK_ID", "base-sepolia")
+# Clamped to 1s so a 0 from a test config cannot turn the loop into a spin
+PRICE_POLL_SECONDS = max(int(os.getenv("PRICE_POLL_SECONDS", 300)), 1)
+
+# Public Coinbase spot-price endpoint
+SPOT_PRICE_URL_TEMPLATE = "https://api.coinbase.com/v2/prices/{pair}/spot"
+
+# Log reason for each trade signal
+SIGNAL_REASONS = {"BUY": "Z-Score too low", "SELL": "Z-Score too high"}
+
+# Upper bound on waiting for any per-tick request
+REQUEST_WAIT_SECONDS = 30
+
+# Backoff after a failed price fetch: 5s, 10s, 20s, ... capped at 60s
+FETCH_RETRY_INITIAL_SECONDS = 5
+FETCH_RETRY_MAX_SECONDS = 60
 
 # Setup Logging
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Buffer file writes: flush every 64 records, immediately on ERROR+, and
+# after every trade signal (see execute_trade) so signals are never held back.
+# basicConfig only formats the MemoryHandler, so the target needs its own.
+file_handler = logging.FileHandler(LOG_FILE)
+file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+file_log_buffer = logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.ERROR, target=file_handler)
+
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler(LOG_FILE),
+        file_log_buffer,
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger("SentinelAlpha")
 
+class RollingWindow:
+    """Time-bounded window of floats with O(1) running mean and std."""
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._points = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+    def __len__(self):
+        return len(self._points)
+
+    def append(self, timestamp, value):
+        """Add a value and evict everything older than max_age."""
+        self._points.append((timestamp, value))
+        self._sum += value
+        self._sumsq += value * value
+
+        cutoff = timestamp - self.max_age
+        while self._points and self._points[0][0] <= cutoff:
+            _, old = self._points.popleft()
+            self._sum -= old
+            self._sumsq -= old * old
+
+    @property
+    def last(self):
+        return self._points[-1][1]
+
+    def mean(self):
+        return self._sum / len(self._points)
+
+    def std(self):
+        """Sample standard deviation (ddof=1), matching pandas."""
+        n = len(self._points)
+        if n < 2:
+            return float("nan")
+        var = (self._sumsq - self._sum * self._sum / n) / (n - 1)
+        return math.sqrt(max(var, 0.0))
+
 class SentinelAlpha:
     def __init__(self):
         self.wallet_provider = self._init_wallet()
         # Initialize AgentKit with the provider
         agent_kit_config = AgentKitConfig(wallet_provider=self.wallet_provider)
         self.agent_kit = AgentKit(agent_kit_config)
+
+        # Worker threads for the per-tick BTC and ETH spot-price requests
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        # The CDP balance call has no timeout of its own, so it gets a separate
+        # worker: a hung call can then never starve the price fetches
+        self._balance_pool = ThreadPoolExecutor(max_workers=1)
+        self._balance_future = None
+
+        # Keep-alive session so polls reuse TLS connections to Coinbase
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self._price_urls = {
+            pair: SPOT_PRICE_URL_TEMPLATE.format(pair=pair)
+            for pair in ("BTC-USD", "ETH-USD")
+        }
+        # (ETag, price) of the last response per pair, for If-None-Match revalidation.
+        # Stored as one tuple so a 304 can never see an ETag without its price.
+        self._cached_prices = {}
         
-        # Initialize price history with dtypes
-        self.price_history = pd.DataFrame(columns=["timestamp", "btc_price", "eth_price"])
-        self.price_history["timestamp"] = pd.to_datetime(self.price_history["timestamp"])
-        self.price_history["btc_price"] = self.price_history["btc_price"].astype(float)
-        self.price_history["eth_price"] = self.price_history["eth_price"].astype(float)
+        # Running stats for the BTC/ETH ratio over the rolling window
+        # Keyed on time.monotonic() so wall-clock jumps cannot skew the window
+        self.ratio_window = RollingWindow(WINDOW_SIZE_HOURS * 3600.0)
+
+        # Set by stop(); the main loop waits on it between polls
+        self._stop = threading.Event()
+        self._retry_wait = FETCH_RETRY_INITIAL_SECONDS
 
         self.initial_daily_balance = None
-        self.last_balance_check = datetime.min
+        self.last_balance = None  # Balance fetched by this tick's stop-loss check
+        self.last_balance_check = None  # time.monotonic() of the last daily reset
         
     def _init_wallet(self):
         """Initialize the CDP Wallet Provider."""
@@ -77,68 +164,85 @@ class SentinelAlpha:
         logger.info(f"Wallet initialized on {NETWORK_ID}. Address: {provider.get_address()}")
         return provider
 
-    def fetch_prices(self):
-        """Fetch real BTC/USD and ETH/USD prices using the Coinbase API."""
+    def _fetch_spot_price(self, pair):
+        """Fetch a single spot price from the public Coinbase API."""
+        cached = self._cached_prices.get(pair)
+        headers = {"If-None-Match": cached[0]} if cached else None
+        response = self._http.get(self._price_urls[pair], headers=headers, timeout=15)
+        if response.status_code == 304:
+            return cached[1]
+
+        data = orjson.loads(response.content)
+        price = float(data['data']['amount'])
+        if "ETag" in response.headers:
+            self._cached_prices[pair] = (response.headers["ETag"], price)
+        return price
+
+    def fetch_prices(self, btc_future, eth_future):
+        """Collect in-flight BTC/USD and ETH/USD price requests. Returns False on failure."""
         try:
-            # We use the underlying CDP SDK client for public price data
-            client = self.wallet_provider.get_client()
+            btc_price = btc_future.result(timeout=REQUEST_WAIT_SECONDS)
+            eth_price = eth_future.result(timeout=REQUEST_WAIT_SECONDS)
             
-            # Note: The CDP SDK allows fetching prices for various pairs
-            # Here we use the standard approach to get the spot price
-            import requests
-            
-            # Using public Coinbase API for reliability in the fetch loop
-            # This ensures we always get high-signal data for the Z-score
-            btc_data = requests.get("https://api.coinbase.com/v2/prices/BTC-USD/spot").json()
-            eth_data = requests.get("https://api.coinbase.com/v2/prices/ETH-USD/spot").json()
-            
-            btc_price = float(btc_data['data']['amount'])
-            eth_price = float(eth_data['data']['amount'])
-            
-            new_row = pd.DataFrame([{
-                "timestamp": datetime.now(),
-                "btc_price": btc_price,
-                "eth_price": eth_price
-            }])
-            self.price_history = pd.concat([self.price_history, new_row], ignore_index=True)
-            
-            # Maintain 24 hour window
-            cutoff = datetime.now() - timedelta(hours=WINDOW_SIZE_HOURS)
-            self.price_history = self.price_history[self.price_history["timestamp"] > cutoff]
+            # The window evicts points older than WINDOW_SIZE_HOURS itself
+            self.ratio_window.append(time.monotonic(), btc_price / eth_price)
             
             logger.info(f"Price Update - BTC: ${btc_price:,.2f} | ETH: ${eth_price:,.2f}")
+            return True
             
+        except TimeoutError:
+            logger.error(f"Error fetching real prices: no response after {REQUEST_WAIT_SECONDS}s")
+            return False
         except Exception as e:
             logger.error(f"Error fetching real prices: {e}")
+            return False
 
     def calculate_z_score(self):
         """Calculate the Z-Score of the BTC/ETH ratio."""
-        if len(self.price_history) < 2: # Min 2 points for initial calc
+        if len(self.ratio_window) < 2: # Min 2 points for initial calc
             return None
         
-        df = self.price_history.copy()
-        df['ratio'] = df['btc_price'] / df['eth_price']
+        rolling_mean = self.ratio_window.mean()
+        rolling_std = self.ratio_window.std()
         
-        rolling_mean = df['ratio'].mean()
-        rolling_std = df['ratio'].std()
-        
-        if rolling_std == 0 or np.isnan(rolling_std) or len(df) < 2:
+        if rolling_std == 0 or math.isnan(rolling_std):
             return 0
             
-        current_ratio = df['ratio'].iloc[-1]
+        current_ratio = self.ratio_window.last
         z_score = (current_ratio - rolling_mean) / rolling_std
         return z_score
 
-    def check_stop_loss(self):
+    def _fetch_balance(self):
+        """Fetch the current wallet balance from the CDP provider."""
+        return float(self.wallet_provider.get_balance())
+
+    def _submit_balance_fetch(self):
+        """Start a balance fetch, or return None while the previous one is still running."""
+        if self._balance_future is not None and not self._balance_future.done():
+            return None
+        self._balance_future = self._balance_pool.submit(self._fetch_balance)
+        return self._balance_future
+
+    def check_stop_loss(self, balance_future):
         """Verify if the daily stop loss has been triggered."""
+        if balance_future is None:
+            self.last_balance = None
+            logger.error("Error checking balance: previous balance request still pending")
+            return True
         try:
-            current_balance = float(self.wallet_provider.get_balance())
+            current_balance = balance_future.result(timeout=REQUEST_WAIT_SECONDS)
+        except TimeoutError:
+            self.last_balance = None
+            logger.error(f"Error checking balance: no response after {REQUEST_WAIT_SECONDS}s")
+            return True
         except Exception as e:
+            self.last_balance = None
             logger.error(f"Error checking balance: {e}")
             return True
+        self.last_balance = current_balance
         
-        now = datetime.now()
-        if self.initial_daily_balance is None or (now - self.last_balance_check).days >= 1:
+        now = time.monotonic()
+        if self.initial_daily_balance is None or now - self.last_balance_check >= 86400:
             self.initial_daily_balance = current_balance
             self.last_balance_check = now
             logger.info(f"Daily balance reset: {current_balance} ETH")
@@ -153,16 +257,21 @@ class SentinelAlpha:
             return False
         return True
 
-    def execute_trade(self, signal, asset="ETH"):
+    def execute_trade(self, side, balance, asset="ETH"):
         """Execute a trade (or log a shadow trade in DRY_RUN)."""
+        if side not in SIGNAL_REASONS:
+            logger.error(f"Ignoring unknown signal: {side}")
+            return
+        if balance is None:
+            logger.warning(f"Skipping {side} signal: wallet balance unavailable this tick")
+            return
         try:
-            balance = float(self.wallet_provider.get_balance())
             trade_amount = balance * TRADE_SIZE_PCT
             
-            if signal == "BUY":
-                logger.info(f"SIGNAL: BUY (Z-Score too low). Shadow Trade: {trade_amount:.6f} {asset} (DRY_RUN={DRY_RUN})")
-            elif signal == "SELL":
-                logger.info(f"SIGNAL: SELL (Z-Score too high). Shadow Trade: {trade_amount:.6f} {asset} (DRY_RUN={DRY_RUN})")
+            logger.info("SIGNAL: %s (%s). Shadow Trade: %.6f %s (DRY_RUN=%s)",
+                        side, SIGNAL_REASONS[side], trade_amount, asset, DRY_RUN)
+            # Signals are the record trading_log.txt exists for; write them out now
+            file_log_buffer.flush()
                 
             if not DRY_RUN:
                 # Actual trading logic would go here
@@ -171,34 +280,60 @@ class SentinelAlpha:
         except Exception as e:
             logger.error(f"Error in execution: {e}")
 
+    def stop(self):
+        """Ask the main loop to exit; wakes it immediately if it is waiting."""
+        self._stop.set()
+
     def run(self):
         """Main loop."""
         logger.info(f"Sentinel-Alpha Started. Strategy: Mean Reversion | DRY_RUN: {DRY_RUN}")
-        while True:
+        while not self._stop.is_set():
             try:
-                if not self.check_stop_loss():
+                # Start all three requests at once so a tick costs the slowest of them.
+                # Prices come from the public Coinbase API for reliable Z-score data.
+                balance_future = self._submit_balance_fetch()
+                btc_future = self._pool.submit(self._fetch_spot_price, "BTC-USD")
+                eth_future = self._pool.submit(self._fetch_spot_price, "ETH-USD")
+
+                if not self.check_stop_loss(balance_future):
                     break
                     
-                self.fetch_prices()
+                if not self.fetch_prices(btc_future, eth_future):
+                    # Retry no later than a full poll, backing off while the API stays down
+                    self._stop.wait(min(self._retry_wait, PRICE_POLL_SECONDS))
+                    self._retry_wait = min(self._retry_wait * 2, FETCH_RETRY_MAX_SECONDS)
+                    continue
+                self._retry_wait = FETCH_RETRY_INITIAL_SECONDS
+
                 z_score = self.calculate_z_score()
                 
                 if z_score is not None:
-                    logger.info(f"Current Z-Score: {z_score:.4f} (Points: {len(self.price_history)})")
+                    logger.info("Current Z-Score: %.4f (Points: %d)", z_score, len(self.ratio_window))
                     
                     if z_score < -Z_SCORE_THRESHOLD:
-                        self.execute_trade("BUY")
+                        self.execute_trade("BUY", self.last_balance)
                     elif z_score > Z_SCORE_THRESHOLD:
-                        self.execute_trade("SELL")
+                        self.execute_trade("SELL", self.last_balance)
                 else:
                     logger.info("Collecting initial data points...")
                 
-                # Check every 5 minutes (300 seconds)
-                time.sleep(300)
+                self._stop.wait(PRICE_POLL_SECONDS)
                 
             except Exception as e:
                 logger.error(f"Error in main loop: {e}")
-                time.sleep(60)
+                self._stop.wait(min(FETCH_RETRY_MAX_SECONDS, PRICE_POLL_SECONDS))
+        logger.info("Sentinel-Alpha stopped.")
 
 if __name__ == "__main__":
     agent = SentinelAlpha()
+
+    def handle_shutdown(signum, frame):
+        """Stop gracefully on the first signal; a second one kills the process."""
+        agent.stop()
+        default = signal.default_int_handler if signum == signal.SIGINT else signal.SIG_DFL
+        signal.signal(signum, default)
+
+    # docker stop sends SIGTERM; exit promptly instead of finishing the sleep
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, handle_shutdown)
     agent.run()